@@ -20,6 +20,24 @@ Main features:
 
  * default testing by diff to expected output
 
+ * generated test inputs and expected outputs
+
+    - a test may specify a 'generator' command (with parameters
+      'seed' and 'size') and a 'reference' command (or a custom
+      'check') instead of pre-committed .in and .out files
+
+    - generated files are cached by a hash of the commands, their
+      parameters and the referenced source files; they are shared by
+      all participants and submissions
+
+ * resumable test runs
+
+    - each finished test result is appended to a checkpoint journal
+      together with a digest of the test inputs
+
+    - with --resume, tests that passed according to the journal and
+      whose inputs did not change are not run again
+
  * support multiple submissions per assignment per user
 
     - allows /dictionaries of submissions/ in
@@ -84,6 +102,8 @@ import logging
 import os
 import subprocess
 import re
+import hashlib
+import json
 
 def load_test_configuration():
     """Load the configuration from the yaml files"""
@@ -180,6 +200,260 @@ def enumerate_tests(participant_name, assignment, submission_id, the_tests):
     for test_id,test in enumerate(tests):
         the_tests.append([participant_name,assignment,submission_id,test_id,test])
 
+def update_digest_file(h, fpath):
+    """Update hash h by the content of file fpath
+    (or a marker if the file does not exist)
+    """
+    if not os.path.isfile(fpath):
+        h.update(b"\0missing\0")
+        return
+    with open(fpath, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1<<16), b""):
+            h.update(chunk)
+
+def update_digest_command_files(h, command, directory):
+    """Update hash h by the files of directory that are named in command
+    (e.g. the sources of generator, reference or checker scripts)
+    """
+    for token in str(command).split():
+        fpath = os.path.join(directory,token)
+        if os.path.isfile(fpath):
+            h.update(token.encode("utf-8"))
+            update_digest_file(h, fpath)
+
+def test_data_digest(assignment, test):
+    """
+    Compute the cache key of the generated data of a test
+    
+    The key depends on the generator and reference commands, their
+    parameters and all files of the assignment directory that are
+    named in the commands (e.g. the generator and reference sources).
+
+    @param assignment the assignment record
+    @param test dictionary of the test
+    @return hex digest
+    """
+    directory = assignment["directory"]
+
+    h = hashlib.sha256()
+    spec = { key: get_feature(test,key,None)
+             for key in ["generator","reference","seed","size","arguments"] }
+    h.update(json.dumps(spec, sort_keys=True, default=str).encode("utf-8"))
+
+    for key in ["generator","reference"]:
+        if exists_and_defined(key, test):
+            update_digest_command_files(h, test[key], directory)
+    return h.hexdigest()
+
+def generate_test_data(assignment, test_id, test, the_test_data, cache_dir):
+    """
+    Generate input and expected output of a test by its generator
+    and reference commands, unless they are cached already.
+    Register the generated files.
+
+    @param assignment the assignment record
+    @param test_id index of the test
+    @param test dictionary of the test
+    @param[out] the_test_data dictionary of generated test data; maps
+      (assignment name, test id) to a dictionary with entries 'infile'
+      and (if there is a reference) 'outfile'; or None on failure
+    @param cache_dir directory of the cache
+    @return success status
+    """
+    key = (assignment["name"], test_id)
+    if key in the_test_data:
+        return the_test_data[key] is not None
+
+    directory = assignment["directory"]
+
+    digest = test_data_digest(assignment, test)
+    cache_dir = os.path.abspath(cache_dir)
+
+    test_data = { "infile": os.path.join(cache_dir, digest+".in") }
+    if exists_and_defined("reference", test):
+        test_data["outfile"] = os.path.join(cache_dir, digest+".out")
+
+    if all( [ os.path.isfile(f) for f in test_data.values() ] ):
+        logging.debug("Use cached test data "+digest+" for test "+str(test_id+1)
+                      +" of assignment '"+assignment["name"]+"'.")
+        the_test_data[key] = test_data
+        return True
+
+    generator_params = { 'seed': get_feature(test,"seed",""),
+                         'size': get_feature(test,"size",""),
+                         'arguments': get_feature(test,"arguments",""),
+                         'infile': test_data["infile"] }
+
+    commands = [ (test["generator"], test_data["infile"]) ]
+    if "outfile" in test_data:
+        commands.append( (test["reference"], test_data["outfile"]) )
+
+    tmpfile = None
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        for command, target in commands:
+            command = str(command).format(**generator_params)
+            logging.info("Generate "+target+" by: "+command)
+            # write to temporary file first, such that interrupted
+            # runs never leave incomplete files in the cache
+            tmpfile = target+".tmp"
+            check_call_bash_script(["cd "+directory,
+                                    "set -o pipefail",
+                                    command+" >"+tmpfile])
+            os.replace(tmpfile, target)
+
+    except (subprocess.CalledProcessError, KeyError, OSError) as exc:
+        logging.error("Generation of test data failed.")
+        logging.debug(exc)
+        # don't leave partial output in the cache
+        if tmpfile is not None and os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+        the_test_data[key] = None
+        return False
+
+    the_test_data[key] = test_data
+    return True
+
+def test_input_digest(program_file, language, test, testcall_params, check_template, directory):
+    """
+    Compute the digest of all inputs of a test run
+
+    The digest covers the submitted program, its language, the test
+    record, the input and expected output files and the check command
+    (including the files named in it; the command is taken unformatted,
+    since the generated output file must not affect the digest).
+
+    @param program_file file of the submitted program
+    @param language the language record
+    @param test dictionary of the test
+    @param testcall_params parameters of the test call
+    @param check_template the (default or custom) check command before formatting
+    @param directory the assignment directory
+    @return hex digest
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([language,test,check_template], sort_keys=True, default=str).encode("utf-8"))
+    for fpath in [program_file,
+                  os.path.join(directory,testcall_params["infile"]),
+                  os.path.join(directory,testcall_params["outfile"])]:
+        update_digest_file(h, fpath)
+    update_digest_command_files(h, check_template, directory)
+    return h.hexdigest()
+
+def load_checkpoints(checkpoint_file):
+    """
+    Load the completed tests from a checkpoint journal
+
+    Invalid entries and incomplete lines (e.g. due to an interrupted
+    run) are ignored.
+
+    @param checkpoint_file name of the journal
+    @return dictionary that maps (participant name, assignment name,
+      submission id, test id) to the journal entry
+    """
+    the_checkpoints = dict()
+    if not os.path.isfile(checkpoint_file):
+        logging.info("No checkpoint journal "+checkpoint_file+"; start from scratch.")
+        return the_checkpoints
+
+    try:
+        with open(checkpoint_file) as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                    key = (entry["participant_name"], entry["assignment_name"],
+                           entry["submission_id"], entry["test_id"])
+                    hash(key)
+                    for field in ["test_description","input_digest","status"]:
+                        if not isinstance(entry[field], str):
+                            raise TypeError(field+" is not a string")
+                except (ValueError, KeyError, TypeError):
+                    logging.debug("Ignore invalid checkpoint entry: "+line)
+                    continue
+                the_checkpoints[key] = entry
+    except OSError as exc:
+        logging.warning("Cannot read checkpoint journal "+checkpoint_file+"; start from scratch.")
+        logging.debug(exc)
+        return dict()
+
+    logging.info("Resume from "+str(len(the_checkpoints))+" checkpoints in "+checkpoint_file)
+    return the_checkpoints
+
+def write_checkpoints(checkpoint_file, entries):
+    """
+    (Re-)write the checkpoint journal with the given entries
+
+    The journal is replaced atomically, such that it never ends in an
+    incomplete line.
+
+    @param checkpoint_file name of the journal
+    @param entries list of journal entries
+    @return success status
+    """
+    tmpfile = checkpoint_file+".tmp"
+    try:
+        directory = os.path.dirname(checkpoint_file)
+        if directory != "" and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(tmpfile, "w") as fh:
+            for entry in entries:
+                fh.write(json.dumps(entry, default=str)+"\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmpfile, checkpoint_file)
+    except OSError as exc:
+        logging.warning("Cannot write checkpoint journal "+checkpoint_file+"; continue without checkpoints.")
+        logging.debug(exc)
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+        return False
+    return True
+
+def append_checkpoint(checkpoint_file, entry):
+    """
+    Append entry to the checkpoint journal and sync it to disk
+    @return success status
+    """
+    try:
+        with open(checkpoint_file, "a") as fh:
+            fh.write(json.dumps(entry, default=str)+"\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+    except OSError as exc:
+        logging.warning("Cannot append to checkpoint journal "+checkpoint_file+"; continue without checkpoints.")
+        logging.debug(exc)
+        return False
+    return True
+
+def prune_test_data_cache(configuration, cache_dir):
+    """
+    Remove generated test data from the cache that is not used by any
+    test of the configuration (e.g. after changing a generator)
+
+    @param configuration the entire configuration
+    @param cache_dir directory of the cache
+    """
+    if not os.path.isdir(cache_dir):
+        return
+
+    used_digests = set()
+    for assignment in configuration["assignments"]:
+        for test in get_feature(assignment,"tests",list()):
+            if exists_and_defined("generator", test):
+                used_digests.add(test_data_digest(assignment, test))
+
+    for fname in os.listdir(cache_dir):
+        digest, ext = os.path.splitext(fname)
+        if ext in [".in",".out"] and digest not in used_digests:
+            logging.debug("Remove unused test data "+fname+" from the cache.")
+            try:
+                os.remove(os.path.join(cache_dir,fname))
+            except OSError as exc:
+                logging.warning("Cannot remove unused test data "+fname+" from the cache.")
+                logging.debug(exc)
+
 def check_call_bash_script(shell_script):
     """Run bash shell script after wrapping it in bash call
     @param shell_script multiline shell script as list of lines
@@ -297,7 +571,8 @@ def compile_submission(participant_name,
 
     return True
 
-def run_test(test_spec,test_results,the_conda_environments,configuration):
+def run_test(test_spec,test_results,the_conda_environments,the_test_data,
+             the_checkpoints,configuration):
     """
     Run tests for an assignment
     @param test_spec = [participant_name, assignment, submission_id, test_id, test]
@@ -306,7 +581,11 @@ def run_test(test_spec,test_results,the_conda_environments,configuration):
     @subparam test_id index of the test
     @subparam test dictionary of the test
     @param test_results hash of the test results
+    @param the_test_data dictionary of (successfully) generated test data
+    @param the_checkpoints dictionary of completed tests (for resuming)
     @param configuration the entire configuration
+    @return checkpoint entry of the performed test or None if the test
+      was not performed
 
     @todo merge with run_test
     """
@@ -351,6 +630,33 @@ def run_test(test_spec,test_results,the_conda_environments,configuration):
                      'genfile': assignment_name+"-"+test_descr+".gen", # generated output file
                      'arguments': get_feature(test,"arguments","")}
 
+    ## use generated input and expected output (if any)
+    if exists_and_defined("generator", test):
+        testcall_params.update(the_test_data[(assignment_name,test_id)])
+
+    check_template = get_feature(test,"check",
+                                 "diff -d -y --suppress-common-lines {genfile} {outfile} | head -n10")
+    check_command = check_template.format(**testcall_params)
+
+    ## skip the test if it passed before and its inputs are unchanged;
+    ## failures (e.g. time outs on an overloaded runner) are always re-run
+    input_digest = test_input_digest(os.path.join(directory,program_name+suffix),
+                                     language, test, testcall_params, check_template, directory)
+    checkpoint = get_feature(the_checkpoints,
+                             (participant_name, assignment_name, submission_id, test_id),
+                             None)
+    if (checkpoint is not None
+        and checkpoint["input_digest"] == input_digest
+        and checkpoint["status"] == "OK"):
+        logging.info(" ... "+checkpoint["status"]+" (resumed from checkpoint).")
+        test_results.append({ key: checkpoint[key]
+                              for key in ["participant_name",
+                                          "assignment_name",
+                                          "submission_id",
+                                          "test_description",
+                                          "status"] })
+        return
+
     program_call = os.path.join(".",program_name)
     if "call" in language:
         program_call = language["call"].format(**testcall_params)
@@ -379,10 +685,6 @@ def run_test(test_spec,test_results,the_conda_environments,configuration):
         program_call_command = (program_call
                                 +" {arguments} {infile} >{genfile}".format(**testcall_params))
 
-        check_command = "diff -d -y --suppress-common-lines {genfile} {outfile} | head -n10".format(**testcall_params)
-        if exists_and_defined("check", test):
-            check_command = test["check"].format(**testcall_params)
-
         logging.info("Program call: "+program_call_command)
         if timeout is not None:
             logging.info("Timeout: "+timeout)
@@ -422,6 +724,16 @@ def run_test(test_spec,test_results,the_conda_environments,configuration):
         "status": status
     })
 
+    return {
+        "participant_name": participant_name,
+        "assignment_name": assignment_name,
+        "submission_id": submission_id,
+        "test_id": test_id,
+        "test_description": test_descr,
+        "input_digest": input_digest,
+        "status": status
+    }
+
 def syntax_checks(configuration):
     """
     Perform some general syntax checks of the configuration
@@ -432,6 +744,17 @@ def syntax_checks(configuration):
             if not feature in assignment:
                 logging.error("Missing required feature "+feature+" in assignment "+str(assignment_index+1)+"!")
                 exit(-1);
+        for test_index,test in enumerate(get_feature(assignment,"tests",list())):
+            test_descr = "test "+str(test_index+1)+" of assignment "+str(assignment["name"])
+            if exists_and_defined("generator", test):
+                # generated input has no pre-committed expected output
+                if not (exists_and_defined("reference", test)
+                        or exists_and_defined("check", test)):
+                    logging.error("Generator in "+test_descr+" requires feature reference or check!")
+                    exit(-1);
+            elif exists_and_defined("reference", test):
+                logging.error("Reference in "+test_descr+" requires feature generator!")
+                exit(-1);
 
 def check_submission(participant_name, submission_name, submission_id, configuration):
     """
@@ -585,11 +908,45 @@ def main( args ):
             if assignment["name"] == test_assignment:
                 enumerate_tests(participant_name, assignment, submission_id, the_tests)
     
+    ## generate test data (once per test, shared by all submissions)
+    the_test_data = dict()
+    generator_failures = list()
+    for [_, assignment, _, test_id, test] in the_tests:
+        if exists_and_defined("generator", test):
+            if not generate_test_data(assignment, test_id, test, the_test_data, args.cache_dir):
+                generator_failures.append("'"+get_feature(test,"name",str(test_id+1))
+                                          +"' of assignment '"+assignment["name"]+"'")
+    prune_test_data_cache(configuration, args.cache_dir)
+
+    # failing generators are errors of the assignment configuration,
+    # not of the submissions; therefore, don't run (and fail) the tests
+    if len(generator_failures)>0:
+        for env in the_conda_environments:
+            cleanup_conda_env(env)
+        logging.error("Generation of test data FAILED for test "
+                      +", ".join(sorted(set(generator_failures))) + ".")
+        logging.error("This is an error in the assignment configuration (generator or reference), "
+                      +"not in the submissions. No tests are performed.")
+        exit(-1)
+
+    ## continue from the checkpoint journal or start a new one
+    ## (rewriting drops invalid or incomplete entries of interrupted runs)
+    checkpoint_file = args.checkpoint
+    if args.resume:
+        the_checkpoints = load_checkpoints(checkpoint_file)
+    else:
+        the_checkpoints = dict()
+    if not write_checkpoints(checkpoint_file, list(the_checkpoints.values())):
+        checkpoint_file = None
 
     # perform tests for the (valid) un-tested submissions
     logging.debug("Perform the tests")
     for test_spec in the_tests:
-        run_test(test_spec, test_results, the_conda_environments, configuration)
+        checkpoint = run_test(test_spec, test_results, the_conda_environments, the_test_data,
+                              the_checkpoints, configuration)
+        if (checkpoint is not None and checkpoint_file is not None
+            and not append_checkpoint(checkpoint_file, checkpoint)):
+            checkpoint_file = None
         
     # cleanup all created conda environments
     for env in the_conda_environments:
@@ -671,6 +1028,12 @@ if __name__=="__main__":
     parser.add_argument('--participant', help="Registered name of participant.")
     parser.add_argument('--skip-depends', action="store_true",
                         help="Skip installation of language dependencies.")
+    parser.add_argument('--cache-dir', default=".gitcats-cache",
+                        help="Directory for caching generated test data.")
+    parser.add_argument('--checkpoint', default=".gitcats-checkpoint.jsonl",
+                        help="Journal of completed tests.")
+    parser.add_argument('--resume', action="store_true",
+                        help="Resume from the checkpoint journal; skip passed tests with unchanged inputs.")
     parser.add_argument('--loglevel', default="INFO", help="Logging level")
 
     args = parser.parse_args()